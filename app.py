@@ -1,15 +1,41 @@
 # app.py
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
+import functools
+import itertools
 import json
+import logging
 import random
 import re
+from collections import OrderedDict, deque
 from datetime import datetime
 from textblob import TextBlob
+from textblob.en import sentiment as sentiment_lexicon
 import nltk
+import orjson
 import ssl
 import os
+import threading
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Per-request debug output (enable with logging.DEBUG)
+logger = logging.getLogger('chatbot')
 
 # Fix for SSL certificate issues on Vercel
 try:
@@ -51,8 +77,92 @@ nltk.download('punkt', download_dir=nltk_data_dir, quiet=True)
 nltk.download('stopwords', download_dir=nltk_data_dir, quiet=True)
 nltk.download('wordnet', download_dir=nltk_data_dir, quiet=True)
 
-# Store conversation contexts
-conversations = {}
+class LRUSessions:
+    """Conversation store that drops the least recently used session when full"""
+    
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+        # Guards the LRU ordering; updates to a session use session_lock()
+        self._lock = threading.Lock()
+    
+    def get(self, session_id):
+        with self._lock:
+            session_data = self._sessions.get(session_id)
+            if session_data is not None:
+                self._sessions.move_to_end(session_id)
+            return session_data
+    
+    def __setitem__(self, session_id, session_data):
+        with self._lock:
+            self._sessions[session_id] = session_data
+            self._sessions.move_to_end(session_id)
+            if len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+    
+    def pop(self, session_id, default=None):
+        with self._lock:
+            return self._sessions.pop(session_id, default)
+
+class RedisSessions:
+    """Conversation store shared by all workers, kept in Redis with a TTL"""
+    
+    def __init__(self, client, ttl=3600):
+        self.client = client
+        self.ttl = ttl
+    
+    def _key(self, session_id):
+        return f'sess:{session_id}'
+    
+    def _decode(self, raw):
+        session_data = orjson.loads(raw)
+        for column in ('roles', 'texts', 'times'):
+            session_data[column] = deque(session_data[column], maxlen=MAX_SESSION_MESSAGES)
+        return session_data
+    
+    def get(self, session_id):
+        raw = self.client.get(self._key(session_id))
+        return None if raw is None else self._decode(raw)
+    
+    def __setitem__(self, session_id, session_data):
+        # Each write refreshes the TTL, so idle sessions expire on their own
+        self.client.setex(self._key(session_id), self.ttl,
+                          orjson.dumps(session_data, default=list))
+    
+    def pop(self, session_id, default=None):
+        key = self._key(session_id)
+        # GET and DEL in one MULTI/EXEC so nothing can write in between
+        raw, _ = self.client.pipeline().get(key).delete(key).execute()
+        return default if raw is None else self._decode(raw)
+    
+    def lock(self, session_id):
+        """Redis lock on one session, held across all workers"""
+        # The timeout frees the lock if a worker dies while holding it
+        return self.client.lock(f'lock:{self._key(session_id)}', timeout=10,
+                                blocking_timeout=10)
+
+# Locks serializing updates to a session within this process, sharded so
+# unrelated sessions rarely wait on each other
+SESSION_LOCK_SHARDS = 16
+_session_locks = tuple(threading.Lock() for _ in range(SESSION_LOCK_SHARDS))
+
+def session_lock(session_id):
+    """Lock to hold while reading or updating a session"""
+    # Sessions in Redis are shared by all workers, so the lock must be too
+    if isinstance(conversations, RedisSessions):
+        return conversations.lock(session_id)
+    return _session_locks[hash(session_id) % SESSION_LOCK_SHARDS]
+
+# Messages kept per session, user and bot (older ones are dropped)
+MAX_SESSION_MESSAGES = 100
+
+# Store conversation contexts (in Redis when REDIS_URL is set, so all
+# workers share them; otherwise in this process)
+if os.environ.get('REDIS_URL'):
+    import redis
+    conversations = RedisSessions(redis.Redis.from_url(os.environ['REDIS_URL']))
+else:
+    conversations = LRUSessions(maxsize=10_000)
 
 # Company information
 COMPANY_NAME = "Your Company"
@@ -60,65 +170,171 @@ BOT_NAME = "SupportBot"
 SUPPORT_EMAIL = "support@yourcompany.com"
 SUPPORT_PHONE = "1-800-123-4567"
 
-# HTML template (keep the same as before - it's long so I'll omit it here)
-# ... (keep your existing HTML template here)
+# Quick reply buttons shown for each intent
+QUICK_REPLIES = {
+    'greeting': ['Store hours', 'Return policy', 'Shipping info', 'Contact us'],
+    'hours': ['Weekend hours', 'Holiday hours', 'Location hours'],
+    'return': ['Start a return', 'Return policy', 'Exchange item', 'Refund status'],
+    'shipping': ['Track my order', 'Shipping cost', 'Delivery time', 'Free shipping'],
+    'payment': ['Credit card', 'PayPal', 'Installments', 'Gift card'],
+    'contact': [SUPPORT_PHONE, 'Email support', 'Live chat', 'Call me'],
+    'thanks': ['You\'re welcome!', 'Any other questions?', 'Have a great day!'],
+    'goodbye': ['Thanks for chatting!', 'Come back soon!', 'Rate your experience'],
+    'default': ['Store hours', 'Return policy', 'Shipping info', 'Contact us']
+}
 
-def analyze_sentiment(message):
-    """Analyze the sentiment of user message"""
+# Name and order number patterns, each folded into one regex (one scan per message)
+NAME_RE = re.compile(r"\b(?:my name is|i am|i['’]m|call me|this is)\s+(\w+)", re.IGNORECASE)
+ORDER_RE = re.compile(r'(?:order\s*#?\s*|#|ORD[-]?|tracking\s*#?\s*)(\d{5,})', re.IGNORECASE)
+
+# Intents checked before all others (greeting is checked last)
+PRIORITY_INTENTS = ['return', 'refund', 'shipping', 'payment', 'contact']
+
+def build_intent_keys():
+    """
+    Map every pattern key to its (priority, intent, required words) entries.
+    Priority intents come first and greeting last; lower numbers win.
+    """
+    ordered = [intent for intent in PRIORITY_INTENTS if intent in responses]
+    ordered += [intent for intent in responses
+                if intent not in ordered and intent not in ('default', 'greeting')]
+    if 'greeting' in responses:
+        ordered.append('greeting')
+    
+    keys = {}
+    for priority, intent in enumerate(ordered):
+        for pattern in responses[intent].get('patterns', []):
+            words = pattern.lower().split()
+            if intent in PRIORITY_INTENTS and len(words) > 1:
+                # Priority patterns match when all their words are in the message
+                for word in words:
+                    keys.setdefault(word, []).append((priority, intent, frozenset(words)))
+            elif words:
+                keys.setdefault(' '.join(words), []).append((priority, intent, None))
+    return {key: tuple(entries) for key, entries in keys.items()}
+
+def build_intent_automaton(keys):
+    """Build an Aho-Corasick automaton over all pattern keys"""
+    automaton = ahocorasick.Automaton()
+    for key, entries in keys.items():
+        automaton.add_word(key, (key, entries))
+    automaton.make_automaton()
+    return automaton
+
+def build_intent_trie(keys):
+    """Build a nested-dict character trie over all pattern keys"""
+    trie = {}
+    for key, entries in keys.items():
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        # None marks the end of a key
+        node[None] = (key, entries)
+    return trie
+
+intent_keys = build_intent_keys()
+# Without pyahocorasick the same keys are matched with the trie
+intent_automaton = build_intent_automaton(intent_keys) if ahocorasick else None
+intent_trie = build_intent_trie(intent_keys)
+
+# Preshuffled, endlessly cycling responses for each intent
+RESP_CURSORS = {intent: itertools.cycle(random.sample(data['responses'], len(data['responses'])))
+                for intent, data in responses.items()}
+
+def normalize_message(message):
+    """Lowercase and strip a user message once for all the matchers below"""
+    return message.lower().strip()
+
+@functools.lru_cache(maxsize=4096)
+def _polarity(message):
+    """TextBlob polarity of a message, cached for repeated quick replies"""
+    return TextBlob(message).sentiment.polarity
+
+def _sentiment_label(polarity):
+    """Bin a polarity score into positive, neutral or negative"""
+    if polarity > 0.3:
+        return 'positive'
+    elif polarity < -0.3:
+        return 'negative'
+    else:
+        return 'neutral'
+
+def _lexicon_free_sentiment(message):
+    """
+    Return 'neutral' for plain text that contains no word TextBlob can score,
+    None when TextBlob has to analyze the message
+    """
+    if SENTIMENT_WORDS is None:
+        return None
+    
+    # Punctuation can form emoticons or boost scores, so leave it to TextBlob
+    if not PLAIN_TEXT_RE.fullmatch(message):
+        return None
+    if SENTIMENT_WORDS.isdisjoint(WORD_RE.findall(message)):
+        return 'neutral'
+    return None
+
+def analyze_sentiment(message, normalized):
+    """
+    Analyze the sentiment of a user message; the normalized text is only used
+    for the fast paths, TextBlob gets the original (emoticons like :D are
+    case-sensitive)
+    """
     try:
-        blob = TextBlob(message)
-        polarity = blob.sentiment.polarity
-        
-        if polarity > 0.3:
-            return 'positive'
-        elif polarity < -0.3:
-            return 'negative'
-        else:
-            return 'neutral'
+        sentiment = PRECOMPUTED_SENTIMENT.get(normalized)
+        if sentiment is None:
+            sentiment = _lexicon_free_sentiment(normalized)
+        if sentiment is None:
+            sentiment = _sentiment_label(_polarity(message))
+        return sentiment
     except:
         return 'neutral'
 
+# Sentiment of quick replies and intent patterns, filled in at startup
+PRECOMPUTED_SENTIMENT = {}
+
+# Words in the TextBlob sentiment lexicon, loaded at startup
+SENTIMENT_WORDS = None
+PLAIN_TEXT_RE = re.compile(r'[a-z\s,?]*')
+WORD_RE = re.compile(r'[a-z]+')
+
+def _warm_textblob():
+    """
+    Load the TextBlob lexicon and precompute sentiment for known messages.
+    This fills SENTIMENT_WORDS and PRECOMPUTED_SENTIMENT, so skipping it turns
+    off both sentiment fast paths and every message goes through TextBlob.
+    """
+    global SENTIMENT_WORDS
+    SENTIMENT_WORDS = frozenset(sentiment_lexicon.keys())
+    
+    known_messages = {reply for replies in QUICK_REPLIES.values() for reply in replies}
+    for data in responses.values():
+        known_messages.update(data.get('patterns', []))
+    
+    for known in known_messages:
+        PRECOMPUTED_SENTIMENT[normalize_message(known)] = _sentiment_label(TextBlob(known).sentiment.polarity)
+
+# Set CHATBOT_SKIP_WARMUP=1 to skip it (e.g. for faster startup in tests)
+if not os.environ.get('CHATBOT_SKIP_WARMUP'):
+    _warm_textblob()
+
 def extract_name(message):
-    """Extract name from common patterns"""
-    message = message.lower()
-    
-    patterns = [
-        r'my name is (\w+)',
-        r'i am (\w+)',
-        r'i\'m (\w+)',
-        r'call me (\w+)',
-        r'this is (\w+)'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, message)
-        if match:
-            for group in match.groups():
-                if group:
-                    return group.capitalize()
-    return None
+    """Extract name from common patterns in a normalized message"""
+    match = NAME_RE.search(message)
+    return match.group(1).capitalize() if match else None
 
 def extract_order_number(message):
     """Extract order number from message"""
-    patterns = [
-        r'order\s*#?\s*(\d{5,})',
-        r'#(\d{5,})',
-        r'ORD[-]?(\d{5,})',
-        r'tracking\s*#?\s*(\d{5,})'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, message, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    return None
+    match = ORDER_RE.search(message)
+    return match.group(1) if match else None
 
+# responses never change after startup, so the intent only depends on the text
+@functools.lru_cache(maxsize=2048)
 def match_intent(message):
     """
     Enhanced intent matching with priority and better pattern matching
+    (expects a message from normalize_message)
     """
-    message = message.lower().strip()
-    
     # Priority 1: Check for name introduction first
     if extract_name(message):
         return 'name_intro'
@@ -127,57 +343,54 @@ def match_intent(message):
     if extract_order_number(message):
         return 'order_tracking'
     
-    # Priority 3: Check for exact matches first
-    # Split message into words for better matching
-    words = set(message.split())
-    
-    # Define priority intents (these should be checked first)
-    priority_intents = ['return', 'refund', 'shipping', 'payment', 'contact']
-    
-    # First check priority intents with exact word matching
-    for intent in priority_intents:
-        if intent in responses:
-            for pattern in responses[intent].get('patterns', []):
-                # Check if the pattern words are in the message
-                pattern_words = set(pattern.split())
-                if pattern_words.issubset(words):
-                    return intent
-    
-    # Then check all other intents
-    for intent, data in responses.items():
-        if intent == 'default' or intent in priority_intents:
-            continue
-            
-        for pattern in data.get('patterns', []):
-            # Check for word boundary matches
-            if re.search(r'\b' + re.escape(pattern) + r'\b', message):
-                return intent
-            # Check if pattern is in message
-            if pattern in message:
-                return intent
+    # Priority 3: Single pass over the message for all intent patterns
+    best = None
+    found_words = set()
+    word_patterns = []
+    for key, entries in find_pattern_keys(message):
+        found_words.add(key)
+        for priority, intent, words in entries:
+            if words is not None:
+                word_patterns.append((priority, intent, words))
+            elif best is None or priority < best[0]:
+                best = (priority, intent)
     
-    # Priority 4: If no match found, check if it's a greeting
-    greeting_patterns = ['hello', 'hi', 'hey', 'greetings']
-    if any(greeting in message for greeting in greeting_patterns):
-        return 'greeting'
+    for priority, intent, words in word_patterns:
+        if (best is None or priority < best[0]) and words <= found_words:
+            best = (priority, intent)
     
-    return 'default'
+    return best[1] if best else 'default'
+
+def find_pattern_keys(message):
+    """Yield (key, entries) for every whole-word pattern key in the message"""
+    length = len(message)
+    
+    if intent_automaton is not None:
+        for end, (key, entries) in intent_automaton.iter(message):
+            start = end - len(key) + 1
+            # Only accept whole-word matches
+            if start > 0 and message[start - 1].isalnum():
+                continue
+            if end + 1 < length and message[end + 1].isalnum():
+                continue
+            yield key, entries
+        return
+    
+    # Walk the trie from every word start, stopping as soon as no key can match
+    for start in range(length):
+        if start > 0 and message[start - 1].isalnum():
+            continue
+        node = intent_trie
+        for end in range(start, length):
+            node = node.get(message[end])
+            if node is None:
+                break
+            if None in node and (end + 1 == length or not message[end + 1].isalnum()):
+                yield node[None]
 
 def get_quick_replies(intent):
     """Get quick replies based on intent"""
-    quick_replies_map = {
-        'greeting': ['Store hours', 'Return policy', 'Shipping info', 'Contact us'],
-        'hours': ['Weekend hours', 'Holiday hours', 'Location hours'],
-        'return': ['Start a return', 'Return policy', 'Exchange item', 'Refund status'],
-        'shipping': ['Track my order', 'Shipping cost', 'Delivery time', 'Free shipping'],
-        'payment': ['Credit card', 'PayPal', 'Installments', 'Gift card'],
-        'contact': [SUPPORT_PHONE, 'Email support', 'Live chat', 'Call me'],
-        'thanks': ['You\'re welcome!', 'Any other questions?', 'Have a great day!'],
-        'goodbye': ['Thanks for chatting!', 'Come back soon!', 'Rate your experience'],
-        'default': ['Store hours', 'Return policy', 'Shipping info', 'Contact us']
-    }
-    
-    return quick_replies_map.get(intent, quick_replies_map['default'])
+    return QUICK_REPLIES.get(intent, QUICK_REPLIES['default'])
 
 def get_personalized_response(intent, session_data, user_message):
     """Get response with personalization"""
@@ -198,21 +411,20 @@ def get_personalized_response(intent, session_data, user_message):
     
     # Handle specific intents
     if intent != 'default' and intent in responses:
-        response = random.choice(responses[intent]['responses'])
-        print(f"🔍 Matched intent: {intent}")  # Debug print
+        response = next(RESP_CURSORS[intent])
+        logger.debug("🔍 Matched intent: %s", intent)
     else:
-        response = random.choice(responses['default']['responses'])
-        print(f"🔍 No match, using default")
+        response = next(RESP_CURSORS['default'])
+        logger.debug("🔍 No match, using default")
     
-    # Personalize with name if we know it
-    if session_data.get('name') and random.random() > 0.5:
+    # Personalize with name (every other message) if we know it
+    if session_data.get('name') and session_data['message_count'] & 1:
         response = f"{session_data['name']}, {response[0].lower() + response[1:]}"
     
     return response
 
-@app.route('/')
-def home():
-    return render_template_string('''
+# Chat page HTML (static, so it is served as-is without Jinja)
+HOME_HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -648,7 +860,13 @@ def home():
         </script>
     </body>
     </html>
-    ''')
+    '''
+
+HOME_HEADERS = {'Cache-Control': 'public, max-age=3600'}
+
+@app.route('/')
+def home():
+    return Response(HOME_HTML, mimetype='text/html', headers=HOME_HEADERS)
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -656,57 +874,65 @@ def chat():
     user_message = data.get('message', '')
     session_id = data.get('session_id', 'default')
     current_sentiment = data.get('sentiment', 'neutral')
+    # One timestamp for everything stored during this request
+    now_iso = datetime.now().isoformat()
     
-    # Get or create session data
-    if session_id not in conversations:
-        conversations[session_id] = {
-            'name': None,
-            'message_count': 0,
-            'last_intent': None,
-            'last_order': None,
-            'messages': [],
-            'created_at': datetime.now().isoformat()
-        }
-    
-    session_data = conversations[session_id]
-    session_data['message_count'] += 1
-    
-    # Store message
-    session_data['messages'].append({
-        'role': 'user',
-        'message': user_message,
-        'timestamp': datetime.now().isoformat()
-    })
+    # Lowercase and strip once for sentiment, intent and entity matching
+    normalized = normalize_message(user_message)
     
     # Analyze sentiment
-    sentiment = analyze_sentiment(user_message)
-    
-    # Check for negative sentiment - offer human agent
-    if sentiment == 'negative' and session_data['message_count'] > 3:
-        response = "I notice you seem frustrated. Would you like me to connect you with a human agent? 🤝"
-        return jsonify({
-            'response': response,
-            'sentiment': sentiment,
-            'quick_replies': ['Yes please', 'No thanks', 'Continue chat'],
-            'session_id': session_id
-        })
-    
-    # Get intent and response
-    intent = match_intent(user_message)
-    session_data['last_intent'] = intent
-    
-    print(f"📝 User message: '{user_message}'")
-    print(f"🎯 Matched intent: '{intent}'")
-    
-    # Get personalized response
-    response = get_personalized_response(intent, session_data, user_message)
-    
-    # Store bot response
-    session_data['messages'].append({
-        'role': 'bot',
-        'message': response,
-        'timestamp': datetime.now().isoformat()
-    })
+    sentiment = analyze_sentiment(user_message, normalized)
+    
+    with session_lock(session_id):
+        # Get or create session data
+        session_data = conversations.get(session_id)
+        if session_data is None:
+            session_data = {
+                'name': None,
+                'message_count': 0,
+                'last_intent': None,
+                'last_order': None,
+                # Message history as parallel role / text / timestamp columns
+                'roles': deque(maxlen=MAX_SESSION_MESSAGES),
+                'texts': deque(maxlen=MAX_SESSION_MESSAGES),
+                'times': deque(maxlen=MAX_SESSION_MESSAGES),
+                'created_at': now_iso
+            }
+        
+        session_data['message_count'] += 1
+        
+        # Store message
+        session_data['roles'].append('user')
+        session_data['texts'].append(user_message)
+        session_data['times'].append(now_iso)
+        
+        # Check for negative sentiment - offer human agent
+        if sentiment == 'negative' and session_data['message_count'] > 3:
+            conversations[session_id] = session_data
+            response = "I notice you seem frustrated. Would you like me to connect you with a human agent? 🤝"
+            return jsonify({
+                'response': response,
+                'sentiment': sentiment,
+                'quick_replies': ['Yes please', 'No thanks', 'Continue chat'],
+                'session_id': session_id
+            })
+        
+        # Get intent and response
+        intent = match_intent(normalized)
+        session_data['last_intent'] = intent
+        
+        logger.debug("📝 User message: '%s'", user_message)
+        logger.debug("🎯 Matched intent: '%s'", intent)
+        
+        # Get personalized response
+        response = get_personalized_response(intent, session_data, normalized)
+        
+        # Store bot response
+        session_data['roles'].append('bot')
+        session_data['texts'].append(response)
+        session_data['times'].append(now_iso)
+        conversations[session_id] = session_data
+        name = session_data.get('name')
     
     # Get quick replies
     quick_replies = get_quick_replies(intent)
@@ -716,29 +942,40 @@ def chat():
         'intent': intent,
         'sentiment': sentiment,
         'quick_replies': quick_replies,
-        'name': session_data.get('name'),
+        'name': name,
         'session_id': session_id
     })
 
 @app.route('/history/<session_id>')
 def get_history(session_id):
-    """Get conversation history"""
-    if session_id in conversations:
-        return jsonify({
-            'history': conversations[session_id].get('messages', []),
-            'session_data': {
-                'name': conversations[session_id].get('name'),
-                'message_count': conversations[session_id].get('message_count'),
-                'created_at': conversations[session_id].get('created_at')
-            }
-        })
-    return jsonify({'history': [], 'session_data': {}})
+    """Get conversation history (streamed one message at a time)"""
+    with session_lock(session_id):
+        session_data = conversations.get(session_id)
+        if session_data is None:
+            return jsonify({'history': [], 'session_data': {}})
+        
+        # Snapshot the columns so /chat can keep appending while we stream
+        messages = tuple(zip(session_data['roles'], session_data['texts'], session_data['times']))
+        meta = {
+            'name': session_data.get('name'),
+            'message_count': session_data.get('message_count'),
+            'created_at': session_data.get('created_at')
+        }
+    
+    def generate():
+        yield b'{"history":['
+        for i, (role, text, timestamp) in enumerate(messages):
+            message = orjson.dumps({'role': role, 'message': text, 'timestamp': timestamp})
+            yield b',' + message if i else message
+        yield b'],"session_data":' + orjson.dumps(meta) + b'}'
+    
+    return Response(generate(), mimetype='application/json')
 
 @app.route('/clear/<session_id>')
 def clear_session(session_id):
     """Clear conversation session"""
-    if session_id in conversations:
-        del conversations[session_id]
+    with session_lock(session_id):
+        conversations.pop(session_id, None)
     return jsonify({'status': 'cleared'})
 
 if __name__ == '__main__':
@@ -750,4 +987,6 @@ if __name__ == '__main__':
     print(f"📍 Open http://localhost:5000 in your browser")
     print(f"📝 Press Ctrl+C to stop")
     print("=" * 50)
-    app.run(debug=True, port=5000)
+    # Development server only; in production run under gunicorn (see README).
+    # Flask turns on debug mode from FLASK_DEBUG itself.
+    app.run(port=5000)
@@ -0,0 +1,5 @@
+import app
+
+
+def test_sentiment_keeps_emoticon_case():
+    assert app.analyze_sentiment("Thanks :D", app.normalize_message("Thanks :D")) == 'positive'